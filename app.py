@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, render_template, request, jsonify, send_file
 import re
 from collections import defaultdict
 import os
@@ -8,6 +8,20 @@ from datetime import datetime
 import tempfile
 import uuid
 import traceback
+import io
+import time
+import contextlib
+import sqlite3
+import threading
+import contextvars
+import functools
+import hmac
+import sys
+import mmap
+import ctypes
+import bisect
+import itertools
+from collections import OrderedDict
 
 # Import PDF library directly
 try:
@@ -19,6 +33,9 @@ except ImportError:
         PdfReader = None
         print("Warning: Neither pypdf nor PyPDF2 is available")
 
+# openpyxl is imported lazily on first export
+Workbook = Font = PatternFill = Alignment = Border = Side = get_column_letter = None
+
 def _import_openpyxl():
     global Workbook, Font, PatternFill, Alignment, Border, Side, get_column_letter
     if Workbook is None:
@@ -64,7 +81,18 @@ except Exception as e:
 IS_CLOUD = os.environ.get('VERCEL') == '1' or os.environ.get('RENDER') == 'true'
 UPLOAD_FOLDER = '/tmp/uploads' if IS_CLOUD else 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024  # 100MB max file size by default
+# Uploads up to this size stay in memory; larger ones spill to a temp file that is mmapped
+UPLOAD_SPOOL_MAX_MEMORY = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY_MB', 8)) * 1024 * 1024
+
+class SpooledUploadRequest(Request):
+    """Request that buffers uploaded files in memory up to UPLOAD_SPOOL_MAX_MEMORY"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Large uploads spill into the upload folder, so make sure it still exists
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY, dir=app.config['UPLOAD_FOLDER'])
+
+app.request_class = SpooledUploadRequest
 
 # Create uploads directory if it doesn't exist
 try:
@@ -89,6 +117,355 @@ def get_claude_api_key():
         raise ValueError("CLAUDE_API_KEY environment variable is required. Please set it in Vercel dashboard: Settings > Environment Variables")
     return api_key
 
+# Shared state
+# gunicorn workers are separate processes, so caches, job status and results
+# live in a SQLite database in WAL mode that every worker can read and write.
+STATE_DB_PATH = os.environ.get('STATE_DB_PATH') or os.path.join(tempfile.gettempdir(), 'statement_sort_state.sqlite3')
+RESULT_TTL_SECONDS = int(os.environ.get('RESULT_TTL_SECONDS', 24 * 60 * 60))
+
+# Expired rows are deleted at most this often per worker
+STATE_PURGE_INTERVAL_SECONDS = 60
+
+_state_local = threading.local()
+# Connections copied over a fork; SQLite must not close them in the child, so
+# they are kept referenced instead of being garbage-collected
+_inherited_state_connections = []
+_last_state_purge = 0.0
+
+def _get_state_db():
+    """Return this thread's SQLite connection, reconnecting after a fork"""
+    conn = getattr(_state_local, 'conn', None)
+    if conn is not None and _state_local.pid == os.getpid():
+        return conn
+    if conn is not None:
+        _inherited_state_connections.append(conn)
+    conn = _open_state_db()
+    _state_local.conn = conn
+    _state_local.pid = os.getpid()
+    return conn
+
+def _open_state_db():
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(
+        'CREATE TABLE IF NOT EXISTS state ('
+        'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, '
+        'PRIMARY KEY (namespace, key));'
+        # Claude rate limiter: token buckets, waiting callers and recent queueing delays
+        'CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL);'
+        'CREATE TABLE IF NOT EXISTS rate_waiters (ticket TEXT PRIMARY KEY, owner TEXT NOT NULL, '
+        'enqueued_at REAL NOT NULL, heartbeat REAL NOT NULL);'
+        'CREATE TABLE IF NOT EXISTS rate_owners (owner TEXT PRIMARY KEY, last_served REAL NOT NULL);'
+        'CREATE TABLE IF NOT EXISTS rate_waits (granted_at REAL NOT NULL, wait REAL NOT NULL, tokens INTEGER NOT NULL);'
+        'CREATE INDEX IF NOT EXISTS rate_waits_granted_at ON rate_waits (granted_at);'
+    )
+    return conn
+
+def state_get_many(namespace, keys, with_expiry=False):
+    """Fetch several keys from the shared store, returning only the ones present.
+    
+    With with_expiry, each value is returned as (value, expires_at).
+    """
+    found = {}
+    keys = list(dict.fromkeys(keys))
+    try:
+        conn = _get_state_db()
+        now = time.time()
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT key, value, expires_at FROM state WHERE namespace = ? AND key IN ({placeholders}) '
+                f'AND (expires_at IS NULL OR expires_at > ?)',
+                [namespace, *chunk, now]
+            ).fetchall()
+            for key, value, expires_at in rows:
+                found[key] = (json.loads(value), expires_at) if with_expiry else json.loads(value)
+    except sqlite3.Error as e:
+        print(f"Warning: shared state read failed: {e}")
+    return found
+
+def state_get(namespace, key, default=None):
+    """Fetch a single key from the shared store"""
+    return state_get_many(namespace, [key]).get(key, default)
+
+def state_set_many(namespace, items, ttl=None):
+    """Write several key/value pairs to the shared store in one transaction"""
+    expires_at = time.time() + ttl if ttl else None
+    rows = [(namespace, key, json.dumps(value), expires_at) for key, value in items.items()]
+    if not rows:
+        return
+    try:
+        conn = _get_state_db()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)', rows)
+    except sqlite3.Error as e:
+        print(f"Warning: shared state write failed: {e}")
+
+def state_set(namespace, key, value, ttl=None):
+    """Write a single key to the shared store"""
+    state_set_many(namespace, {key: value}, ttl=ttl)
+
+def purge_expired_state(conn=None):
+    """Delete expired jobs, results and profiles (on this thread's connection unless one is given)"""
+    global _last_state_purge
+    _last_state_purge = time.time()
+    try:
+        conn = conn or _get_state_db()
+        conn.execute('DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+    except sqlite3.Error as e:
+        print(f"Warning: shared state purge failed: {e}")
+
+def maybe_purge_expired_state():
+    """Purge expired state if this worker hasn't done so in the last STATE_PURGE_INTERVAL_SECONDS"""
+    if time.time() - _last_state_purge >= STATE_PURGE_INTERVAL_SECONDS:
+        purge_expired_state()
+
+def set_job_status(job_id, status, **details):
+    """Record the status of an upload so any worker can report it"""
+    state_set('job', job_id, {'status': status, 'updated_at': time.time(), **details}, ttl=RESULT_TTL_SECONDS)
+
+def get_job_status(job_id):
+    return state_get('job', job_id)
+
+def store_result(result_id, result):
+    state_set('result', result_id, result, ttl=RESULT_TTL_SECONDS)
+    # Expired statements must not outlive the TTL on disk
+    maybe_purge_expired_state()
+
+def load_result(result_id):
+    return state_get('result', result_id)
+
+def _category_cache_key(description):
+    return merchant_key(description)
+
+# Claude API admission control
+# Every call to CLAUDE_API_URL first takes one request and its estimated tokens
+# from per-minute token buckets kept in the shared database, so the limits hold
+# across threads and gunicorn workers. Waiting callers are served round-robin
+# by owner (one owner per upload), so a large statement cannot starve others.
+CLAUDE_REQUESTS_PER_MINUTE = float(os.environ.get('CLAUDE_REQUESTS_PER_MINUTE', 50))
+CLAUDE_TOKENS_PER_MINUTE = float(os.environ.get('CLAUDE_TOKENS_PER_MINUTE', 50000))
+# A single call gives up after this long in the queue...
+CLAUDE_MAX_QUEUE_SECONDS = float(os.environ.get('CLAUDE_MAX_QUEUE_SECONDS', 20))
+# ...and all Claude work for one upload must finish within this budget, well
+# inside the gunicorn worker timeout (120s) so the upload can still report an error
+CLAUDE_UPLOAD_BUDGET_SECONDS = float(os.environ.get('CLAUDE_UPLOAD_BUDGET_SECONDS', 90))
+# Resends of a call rejected with 429 before giving up on it
+CLAUDE_MAX_RETRIES = int(os.environ.get('CLAUDE_MAX_RETRIES', 2))
+
+# Waiters refresh their heartbeat this often; ones that stop (e.g. a killed
+# worker) are ignored and dropped after _RATE_WAITER_STALE_SECONDS. A dead
+# ticket at the head blocks the queue until then, so the window must be well
+# below CLAUDE_MAX_QUEUE_SECONDS or every other waiter gives up first.
+_RATE_WAITER_STALE_SECONDS = min(6.0, CLAUDE_MAX_QUEUE_SECONDS / 3)
+_RATE_WAITER_HEARTBEAT_SECONDS = _RATE_WAITER_STALE_SECONDS / 3
+
+_claude_owner = contextvars.ContextVar('claude_owner', default='default')
+_claude_deadline = contextvars.ContextVar('claude_deadline', default=None)
+
+def set_claude_owner(owner, budget_seconds=None):
+    """Attribute subsequent Claude calls in this context to an upload/job for fair queuing.
+    
+    With budget_seconds, calls fail with TimeoutError once that much time has passed.
+    """
+    _claude_owner.set(owner)
+    _claude_deadline.set(time.time() + budget_seconds if budget_seconds else None)
+
+def _claude_time_left():
+    deadline = _claude_deadline.get()
+    return None if deadline is None else deadline - time.time()
+
+def _refill_bucket(conn, name, capacity, now):
+    row = conn.execute('SELECT level, updated_at FROM rate_buckets WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        return capacity
+    level, updated_at = row
+    return min(capacity, level + (now - updated_at) * capacity / 60.0)
+
+def _save_bucket(conn, name, level, now):
+    conn.execute('INSERT OR REPLACE INTO rate_buckets (name, level, updated_at) VALUES (?, ?, ?)', (name, level, now))
+
+def _rate_queue_head(conn, now):
+    """Ticket at the head of the queue: the owner served least recently, then the oldest waiter"""
+    head = conn.execute(
+        'SELECT w.ticket FROM rate_waiters w LEFT JOIN rate_owners o ON o.owner = w.owner '
+        'WHERE w.heartbeat >= ? ORDER BY COALESCE(o.last_served, 0), w.enqueued_at LIMIT 1',
+        (now - _RATE_WAITER_STALE_SECONDS,)
+    ).fetchone()
+    return head[0] if head else None
+
+def acquire_claude_capacity(estimated_tokens):
+    """Block until one request and estimated_tokens are available; returns the queueing delay"""
+    owner = _claude_owner.get()
+    ticket = str(uuid.uuid4())
+    # A single call larger than the whole bucket could never be admitted
+    estimated_tokens = min(estimated_tokens, CLAUDE_TOKENS_PER_MINUTE)
+    started = time.time()
+    give_up_at = started + CLAUDE_MAX_QUEUE_SECONDS
+    time_left = _claude_time_left()
+    if time_left is not None:
+        if time_left <= 0:
+            raise TimeoutError("No time left in this upload for Claude API calls")
+        give_up_at = min(give_up_at, started + time_left)
+    try:
+        conn = _get_state_db()
+        conn.execute('INSERT INTO rate_waiters (ticket, owner, enqueued_at, heartbeat) VALUES (?, ?, ?, ?)',
+                     (ticket, owner, started, started))
+    except sqlite3.Error as e:
+        print(f"Warning: Claude rate limiter unavailable, calling without it: {e}")
+        return 0.0
+    
+    try:
+        last_heartbeat = started
+        poll = 0.05
+        while True:
+            now = time.time()
+            if now - last_heartbeat >= _RATE_WAITER_HEARTBEAT_SECONDS:
+                conn.execute('UPDATE rate_waiters SET heartbeat = ? WHERE ticket = ?', (now, ticket))
+                conn.execute('DELETE FROM rate_waiters WHERE heartbeat < ?', (now - _RATE_WAITER_STALE_SECONDS,))
+                last_heartbeat = now
+            
+            # Waiters behind the head only read (WAL readers don't block writers)
+            # and back off; the write lock is taken only when it is our turn
+            if _rate_queue_head(conn, now) != ticket:
+                wait = poll
+                poll = min(poll * 2, 0.5)
+            else:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    now = time.time()
+                    if _rate_queue_head(conn, now) != ticket:
+                        continue
+                    requests_level = _refill_bucket(conn, 'requests', CLAUDE_REQUESTS_PER_MINUTE, now)
+                    tokens_level = _refill_bucket(conn, 'tokens', CLAUDE_TOKENS_PER_MINUTE, now)
+                    if requests_level >= 1 and tokens_level >= estimated_tokens:
+                        _save_bucket(conn, 'requests', requests_level - 1, now)
+                        _save_bucket(conn, 'tokens', tokens_level - estimated_tokens, now)
+                        conn.execute('INSERT OR REPLACE INTO rate_owners (owner, last_served) VALUES (?, ?)', (owner, now))
+                        conn.execute('DELETE FROM rate_waiters WHERE ticket = ?', (ticket,))
+                        conn.execute('INSERT INTO rate_waits (granted_at, wait, tokens) VALUES (?, ?, ?)',
+                                     (now, now - started, int(estimated_tokens)))
+                        conn.execute('DELETE FROM rate_waits WHERE granted_at < ?', (now - 3600,))
+                        conn.execute('DELETE FROM rate_owners WHERE last_served < ?', (now - 3600,))
+                        return now - started
+                # Sleep until both buckets should have refilled enough
+                wait = max(
+                    (1 - requests_level) * 60.0 / CLAUDE_REQUESTS_PER_MINUTE,
+                    (estimated_tokens - tokens_level) * 60.0 / CLAUDE_TOKENS_PER_MINUTE,
+                    0.01
+                )
+            
+            remaining = give_up_at - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f"Waited {time.time() - started:.0f}s for Claude API capacity")
+            time.sleep(min(wait, 1.0, remaining))
+    except sqlite3.Error as e:
+        print(f"Warning: Claude rate limiter failed, calling without it: {e}")
+        return time.time() - started
+    finally:
+        try:
+            conn.execute('DELETE FROM rate_waiters WHERE ticket = ?', (ticket,))
+        except sqlite3.Error:
+            pass
+
+def _adjust_claude_tokens(delta, pause_seconds=None):
+    """Correct the token bucket once actual usage is known, or after a 429 pause
+    every worker for pause_seconds by emptying both buckets"""
+    try:
+        conn = _get_state_db()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            if pause_seconds is not None:
+                # The next request becomes available exactly pause_seconds from now
+                _save_bucket(conn, 'requests', 1 - pause_seconds * CLAUDE_REQUESTS_PER_MINUTE / 60.0, now)
+                _save_bucket(conn, 'tokens', 0.0, now)
+            else:
+                level = _refill_bucket(conn, 'tokens', CLAUDE_TOKENS_PER_MINUTE, now)
+                _save_bucket(conn, 'tokens', min(CLAUDE_TOKENS_PER_MINUTE, level - delta), now)
+    except sqlite3.Error as e:
+        print(f"Warning: Claude rate limiter update failed: {e}")
+
+def _estimate_claude_tokens(data):
+    """Rough token count for a request: ~4 characters per input token plus max output"""
+    chars = sum(len(part.get('text', '')) for message in data.get('messages', []) for part in message.get('content', []))
+    return chars // 4 + data.get('max_tokens', 0)
+
+def _retry_after_seconds(response):
+    try:
+        return min(max(float(response.headers.get('retry-after', 5)), 1.0), 60.0)
+    except ValueError:
+        return 5.0
+
+def post_to_claude(headers, data, timeout):
+    """POST to CLAUDE_API_URL once the shared rate limiter admits the call.
+    
+    A 429 pauses every worker for the response's retry-after and the same call
+    is resent; TimeoutError is raised if it is still rejected after
+    CLAUDE_MAX_RETRIES resends or the upload runs out of time.
+    """
+    estimated_tokens = _estimate_claude_tokens(data)
+    for attempt in range(CLAUDE_MAX_RETRIES + 1):
+        waited = acquire_claude_capacity(estimated_tokens)
+        if waited > 1:
+            print(f"Waited {waited:.1f}s for Claude API capacity")
+        
+        time_left = _claude_time_left()
+        if time_left is not None and time_left <= 0:
+            raise TimeoutError("No time left in this upload for Claude API calls")
+        request_timeout = timeout if time_left is None else min(timeout, time_left)
+        response = requests.post(CLAUDE_API_URL, headers=headers, json=data, timeout=request_timeout)
+        if response.status_code != 429:
+            if response.ok:
+                usage = response.json().get('usage') or {}
+                actual_tokens = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+                if actual_tokens:
+                    _adjust_claude_tokens(actual_tokens - estimated_tokens)
+            return response
+        
+        # Our limits are above the account's; make every worker back off
+        retry_after = _retry_after_seconds(response)
+        print(f"Claude API rate limited (attempt {attempt + 1}), retrying after {retry_after:.0f}s")
+        _adjust_claude_tokens(0, pause_seconds=retry_after)
+    raise TimeoutError(f"Claude API still rate limited after {CLAUDE_MAX_RETRIES} retries")
+
+def claude_rate_metrics(window_seconds=300):
+    """Queueing delay statistics for Claude calls over the recent window, across all workers"""
+    conn = _get_state_db()
+    now = time.time()
+    waits = [row[0] for row in conn.execute(
+        'SELECT wait FROM rate_waits WHERE granted_at >= ? ORDER BY wait', (now - window_seconds,)
+    )]
+    tokens = conn.execute('SELECT COALESCE(SUM(tokens), 0) FROM rate_waits WHERE granted_at >= ?',
+                          (now - window_seconds,)).fetchone()[0]
+    queued = conn.execute('SELECT COUNT(*), COUNT(DISTINCT owner) FROM rate_waiters WHERE heartbeat >= ?',
+                          (now - _RATE_WAITER_STALE_SECONDS,)).fetchone()
+    
+    def percentile(p):
+        return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+    
+    return {
+        'window_seconds': window_seconds,
+        'requests_granted': len(waits),
+        'tokens_granted': tokens,
+        'queue_delay_avg': sum(waits) / len(waits) if waits else 0.0,
+        'queue_delay_p50': percentile(0.5),
+        'queue_delay_p95': percentile(0.95),
+        'queue_delay_max': waits[-1] if waits else 0.0,
+        'waiting_requests': queued[0],
+        'waiting_uploads': queued[1],
+        'requests_available': _refill_bucket(conn, 'requests', CLAUDE_REQUESTS_PER_MINUTE, now),
+        'tokens_available': _refill_bucket(conn, 'tokens', CLAUDE_TOKENS_PER_MINUTE, now),
+        'limits': {
+            'requests_per_minute': CLAUDE_REQUESTS_PER_MINUTE,
+            'tokens_per_minute': CLAUDE_TOKENS_PER_MINUTE,
+        },
+    }
+
 # Expense categories
 CATEGORIES = [
     'Food & Dining',
@@ -102,154 +479,430 @@ CATEGORIES = [
     'Other'
 ]
 
-def extract_expenses_from_pdf(pdf_path):
-    """Extract expense transactions from PDF statement using text extraction"""
-    if PdfReader is None:
-        raise ImportError("pypdf is not available. Please install it with: pip install pypdf")
+# Statement parsing and keyword rules are compiled once at import so that
+# preloaded gunicorn workers share them copy-on-write
+
+# Pattern to match transaction lines
+# Format: DD-MMM-YY Description Amount (AED optional)
+# Example: "08-Oct-24 NFC - (AP-PAY)-DUBAI MALL AED 150.00"
+TRANSACTION_PATTERN = re.compile(
+    r'(\d{1,2}-[A-Za-z]{3}-\d{2})\s+'  # Date: DD-MMM-YY
+    r'(.+?)'  # Description (non-greedy)
+    r'\s+(?:AED\s+)?([\d,]+\.?\d*)\s*'  # Amount (optional AED prefix)
+    r'(?:\n|$)',  # End of line
+    re.MULTILINE | re.IGNORECASE
+)
+
+# Alternative pattern for lines without AED prefix
+TRANSACTION_PATTERN_ALT = re.compile(
+    r'(\d{1,2}-[A-Za-z]{3}-\d{2})\s+'  # Date
+    r'(.+?)'  # Description
+    r'\s+([\d,]+\.?\d{2})\s*$',  # Amount with 2 decimals
+    re.MULTILINE | re.IGNORECASE
+)
+
+DATE_PATTERN = re.compile(r'(\d{1,2}-[A-Za-z]{3}-\d{2})')
+
+TRAILING_CURRENCY_PATTERN = re.compile(r'\s+AED$', re.IGNORECASE)
+
+SKIP_KEYWORDS = ['opening balance', 'closing balance', 'total outstanding', 
+                 'transaction date', 'posting date', 'transaction details', 
+                 'original amount', 'total amount', 'important:', 'warning',
+                 'page', 'statement', 'account']
+
+# Quick keyword-based categorization
+KEYWORD_CATEGORIES = {
+    'food': 'Food & Dining',
+    'restaurant': 'Food & Dining',
+    'cafe': 'Food & Dining',
+    'eats': 'Food & Dining',
+    'carrefour': 'Food & Dining',
+    'lulu': 'Food & Dining',
+    'supermarket': 'Food & Dining',
+    'grocery': 'Food & Dining',
+    'uber': 'Transportation',
+    'careem': 'Transportation',
+    'taxi': 'Transportation',
+    'metro': 'Transportation',
+    'amazon': 'Shopping',
+    'shopping': 'Shopping',
+    'mall': 'Shopping',
+    'pharmacy': 'Healthcare',
+    'hospital': 'Healthcare',
+    'medical': 'Healthcare',
+    'salon': 'Personal Care',
+    'gym': 'Personal Care',
+    'fitness': 'Personal Care',
+    'etisalat': 'Bills & Utilities',
+    'du': 'Bills & Utilities',
+    'dewa': 'Bills & Utilities',
+    'utility': 'Bills & Utilities',
+}
+
+# PDF text extraction backends
+# Each backend takes a binary file object and returns the text of every page,
+# one page per chunk joined with newlines. Only installed libraries are registered.
+def _extract_text_pypdf(stream):
+    pdf_reader = PdfReader(stream)
+    num_pages = len(pdf_reader.pages)
+    print(f"PDF has {num_pages} pages")
     
-    expenses = []
+    page_texts = []
+    for i, page in enumerate(pdf_reader.pages):
+        if i % 10 == 0:
+            print(f"Extracting text from page {i+1}/{num_pages}...")
+        page_texts.append(page.extract_text() + "\n")
+    return "".join(page_texts)
+
+def _extract_text_pypdfium2(stream):
+    import pypdfium2
+    if isinstance(stream, mmap.mmap):
+        # pdfium reads mmapped uploads in place through a ctypes view
+        stream = (ctypes.c_char * len(stream)).from_buffer(stream)
+    pdf = pypdfium2.PdfDocument(stream)
+    try:
+        print(f"PDF has {len(pdf)} pages")
+        page_texts = []
+        for page in pdf:
+            text_page = page.get_textpage()
+            # pdfium uses CRLF line endings
+            page_texts.append(text_page.get_text_range().replace('\r\n', '\n').replace('\r', '\n') + "\n")
+            text_page.close()
+            page.close()
+        return "".join(page_texts)
+    finally:
+        pdf.close()
+        # Drop the ctypes view so the mmap can close even if a traceback keeps this frame
+        stream = None
+
+class _MmapReader(io.RawIOBase):
+    """File object over an mmap for libraries that only accept io.IOBase"""
+    def __init__(self, mapped):
+        self._mapped = mapped
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, buffer):
+        data = self._mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._mapped.seek(offset, whence)
+        return self._mapped.tell()
     
+    def tell(self):
+        return self._mapped.tell()
+
+def _as_file(stream):
+    return io.BufferedReader(_MmapReader(stream)) if isinstance(stream, mmap.mmap) else stream
+
+def _extract_text_pdfminer(stream):
+    from pdfminer.high_level import extract_text
+    return extract_text(_as_file(stream))
+
+def _extract_text_pdfplumber(stream):
+    import pdfplumber
+    with pdfplumber.open(_as_file(stream)) as pdf:
+        print(f"PDF has {len(pdf.pages)} pages")
+        return "".join((page.extract_text() or "") + "\n" for page in pdf.pages)
+
+def _module_available(name):
     try:
-        print(f"Opening PDF: {pdf_path}")
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            print(f"PDF has {num_pages} pages")
-            
-            # Extract text from all pages
-            full_text = ""
-            for i, page in enumerate(pdf_reader.pages):
-                if i % 10 == 0:
-                    print(f"Extracting text from page {i+1}/{num_pages}...")
-                full_text += page.extract_text() + "\n"
-            
-            print(f"Extracted {len(full_text)} characters of text")
-            
-            # Pattern to match transaction lines
-            # Format: DD-MMM-YY Description Amount (AED optional)
-            # Example: "08-Oct-24 NFC - (AP-PAY)-DUBAI MALL AED 150.00"
-            transaction_pattern = re.compile(
-                r'(\d{1,2}-[A-Za-z]{3}-\d{2})\s+'  # Date: DD-MMM-YY
-                r'(.+?)'  # Description (non-greedy)
-                r'\s+(?:AED\s+)?([\d,]+\.?\d*)\s*'  # Amount (optional AED prefix)
-                r'(?:\n|$)',  # End of line
-                re.MULTILINE | re.IGNORECASE
-            )
-            
-            # Alternative pattern for lines without AED prefix
-            transaction_pattern_alt = re.compile(
-                r'(\d{1,2}-[A-Za-z]{3}-\d{2})\s+'  # Date
-                r'(.+?)'  # Description
-                r'\s+([\d,]+\.?\d{2})\s*$',  # Amount with 2 decimals
-                re.MULTILINE | re.IGNORECASE
-            )
-            
-            # Find all transaction matches
-            matches = transaction_pattern.findall(full_text)
-            matches_alt = transaction_pattern_alt.findall(full_text)
-            
-            # Combine matches, preferring the first pattern
-            all_matches = matches + [m for m in matches_alt if m not in matches]
-            
-            seen_transactions = set()
-            
-            for match in all_matches:
-                if len(match) < 3:
-                    continue
-                
-                posting_date = match[0].strip()
-                description = match[1].strip()
-                amount_str = match[2].strip()
-                
-                # Skip empty or invalid entries
-                if not posting_date or not description or not amount_str:
-                    continue
-                
-                # Skip header-like rows
-                skip_keywords = ['opening balance', 'closing balance', 'total outstanding', 
-                               'transaction date', 'posting date', 'transaction details', 
-                               'original amount', 'total amount', 'important:', 'warning',
-                               'page', 'statement', 'account']
-                description_lower = description.lower()
-                if any(keyword in description_lower for keyword in skip_keywords):
-                    continue
-                
-                # Skip credits (amounts with CR or negative)
-                if ' CR' in amount_str.upper() or amount_str.upper().strip().endswith('CR'):
-                    continue
-                
-                # Validate date format
-                if not re.match(r'\d{1,2}-[A-Za-z]{3}-\d{2}', posting_date):
-                    continue
-                
-                # Clean and parse amount
-                amount_clean = re.sub(r'[^\d.,-]', '', amount_str)
-                amount_clean = amount_clean.replace(',', '').strip()
-                
-                if not amount_clean:
-                    continue
-                
-                try:
-                    amount_float = float(amount_clean)
-                    if amount_float <= 0:
-                        continue
-                    
-                    # Clean description
-                    description_clean = ' '.join(description.split())
-                    
-                    # Skip if description is too short
-                    if len(description_clean) < 3:
-                        continue
-                    
-                    # Create transaction key to avoid duplicates
-                    transaction_key = (posting_date, description_clean, amount_float)
-                    if transaction_key in seen_transactions:
-                        continue
-                    seen_transactions.add(transaction_key)
-                    
-                    expenses.append({
-                        'date': posting_date,
-                        'description': description_clean,
-                        'amount': amount_float
-                    })
-                except (ValueError, AttributeError):
-                    continue
-            
-            # If no transactions found with regex, try line-by-line parsing
-            if not expenses:
-                lines = full_text.split('\n')
-                current_date = None
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    # Check if line starts with a date
-                    date_match = re.match(r'(\d{1,2}-[A-Za-z]{3}-\d{2})', line)
-                    if date_match:
-                        current_date = date_match.group(1)
-                        # Try to extract amount from same line
-                        amount_match = re.search(r'([\d,]+\.?\d{2})', line)
-                        if amount_match:
-                            desc_part = line[len(date_match.group(0)):amount_match.start()].strip()
-                            amount_str = amount_match.group(1)
-                            if desc_part and len(desc_part) > 3:
-                                try:
-                                    amount_float = float(amount_str.replace(',', ''))
-                                    if amount_float > 0 and 'CR' not in line.upper():
-                                        expenses.append({
-                                            'date': current_date,
-                                            'description': desc_part,
-                                            'amount': amount_float
-                                        })
-                                except ValueError:
-                                    pass
+        __import__(name)
+        return True
+    except Exception:
+        return False
+
+# Registered in rough order of preference when no calibration is possible
+PDF_TEXT_BACKENDS = {}
+if PdfReader is not None:
+    PDF_TEXT_BACKENDS['pypdf'] = _extract_text_pypdf
+if _module_available('pypdfium2'):
+    PDF_TEXT_BACKENDS['pypdfium2'] = _extract_text_pypdfium2
+if _module_available('pdfminer.high_level'):
+    PDF_TEXT_BACKENDS['pdfminer'] = _extract_text_pdfminer
+if _module_available('pdfplumber'):
+    PDF_TEXT_BACKENDS['pdfplumber'] = _extract_text_pdfplumber
+
+_selected_pdf_backend = None
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def build_sample_statement_pdf(transactions, lines_per_page=45):
+    """Build a minimal statement PDF (Helvetica, one transaction per line) in memory"""
+    # Alternate the 'AED 150.00' and bare '150.00' amount layouts the parser accepts
+    lines = [
+        f"{t['date']} {t['description']} {'AED ' if i % 2 == 0 else ''}{t['amount']:,.2f}"
+        for i, t in enumerate(transactions)
+    ]
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    
+    # Object 1: catalog, 2: page tree, 3: font, then a page + content stream pair per page
+    objects = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = ' '.join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    for pid, page_lines in zip(page_ids, pages):
+        content = "BT /F1 9 Tf 12 TL 40 800 Td\n"
+        content += "".join(f"({_pdf_escape(line)}) Tj T*\n" for line in page_lines)
+        content += "ET"
+        content = content.encode('latin-1', 'replace')
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {pid + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+def sample_statement_transactions(count=60, seed=0):
+    """Deterministic synthetic transactions resembling UAE card statements"""
+    import random
+    rng = random.Random(seed)
+    merchants = [
+        'NFC - (AP-PAY)-CARREFOUR MOE DUBAI', 'UBER *TRIP HELP.UBER.COM', 'CAREEM HALA DUBAI',
+        'AMAZON.AE DUBAI', 'LULU HYPERMARKET AL BARSHA', 'DEWA DUBAI', 'ETISALAT AUH',
+        'IAP - (G-PAY)-NETFLIX.COM', 'LIFE PHARMACY JLT', 'SEPHORA DUBAI MALL',
+        'STARBUCKS MARINA WALK', 'FITNESS FIRST DIFC', 'DUBAI METRO NOL TOP UP', 'NOON.COM',
+    ]
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    transactions = []
+    for i in range(count):
+        transactions.append({
+            'date': f"{rng.randint(1, 28):02d}-{rng.choice(months)}-24",
+            'description': f"{rng.choice(merchants)} {rng.randint(1000, 9999)}",
+            'amount': round(rng.uniform(5, 5000), 2),
+        })
+    return transactions
+
+def score_backend_accuracy(expected, extracted):
+    """Share of transactions parsed exactly (date, description, amount); spurious extra rows count against it"""
+    expected_keys = {(t['date'], t['description'], round(t['amount'], 2)) for t in expected}
+    found_keys = [(t['date'], t['description'], round(t['amount'], 2)) for t in extracted]
+    denominator = max(len(expected_keys), len(found_keys))
+    if not denominator:
+        return 1.0
+    return len(expected_keys & set(found_keys)) / denominator
+
+def select_pdf_text_backend(force=False):
+    """Pick the fastest installed backend that parses a synthetic statement correctly.
+    
+    Set PDF_TEXT_BACKEND to skip calibration and use a specific backend.
+    """
+    global _selected_pdf_backend
+    if _selected_pdf_backend is not None and not force:
+        return _selected_pdf_backend
+    if not PDF_TEXT_BACKENDS:
+        raise ImportError("No PDF library is available. Please install one with: pip install pypdf")
     
+    requested = os.environ.get('PDF_TEXT_BACKEND')
+    if requested:
+        if requested in PDF_TEXT_BACKENDS:
+            _selected_pdf_backend = requested
+            print(f"Using PDF text backend from PDF_TEXT_BACKEND: {requested}")
+            return requested
+        print(f"Warning: PDF_TEXT_BACKEND={requested} is not available, calibrating instead")
+    
+    expected = sample_statement_transactions(count=90)
+    sample_pdf = build_sample_statement_pdf(expected)
+    timings = {}
+    for name, backend in PDF_TEXT_BACKENDS.items():
+        try:
+            # Best of two runs so one-off import/initialisation cost doesn't decide
+            elapsed = None
+            for _ in range(2):
+                started = time.perf_counter()
+                text = backend(io.BytesIO(sample_pdf))
+                run_time = time.perf_counter() - started
+                elapsed = run_time if elapsed is None else min(elapsed, run_time)
+            accuracy = score_backend_accuracy(expected, parse_statement_text(text))
+        except Exception as e:
+            print(f"PDF backend {name} failed calibration: {e}")
+            continue
+        print(f"PDF backend {name}: {elapsed * 1000:.1f} ms, accuracy {accuracy:.0%}")
+        if accuracy == 1.0:
+            timings[name] = elapsed
+    
+    if timings:
+        _selected_pdf_backend = min(timings, key=timings.get)
+    else:
+        # Nothing passed; keep the historical default rather than failing uploads
+        _selected_pdf_backend = 'pypdf' if 'pypdf' in PDF_TEXT_BACKENDS else next(iter(PDF_TEXT_BACKENDS))
+    print(f"Selected PDF text backend: {_selected_pdf_backend}")
+    return _selected_pdf_backend
+
+@contextlib.contextmanager
+def pdf_buffer(stream):
+    """Readable view of an uploaded PDF without copying it.
+    
+    In-memory uploads are read from their buffer directly; uploads that spilled
+    to disk are mmapped so pages are loaded on demand instead of read() in full.
+    """
+    # SpooledTemporaryFile wraps either a BytesIO or a real temporary file
+    raw = getattr(stream, '_file', stream)
+    try:
+        fileno = raw.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+    if fileno is None or os.fstat(fileno).st_size == 0:
+        raw.seek(0)
+        yield raw
+        return
+    
+    raw.flush()
+    # Copy-on-write so backends can take a writable ctypes view; nothing writes to it
+    mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A backend leaked a view; the map is released with it
+            print("Warning: upload buffer still in use, leaving it to be unmapped later")
+
+def extract_text_from_pdf(pdf, backend=None):
+    """Extract the full text of a PDF (path or readable binary buffer) with the given or auto-selected backend"""
+    backend = backend or select_pdf_text_backend()
+    if isinstance(pdf, (str, os.PathLike)):
+        with open(pdf, 'rb') as file:
+            return PDF_TEXT_BACKENDS[backend](file)
+    return PDF_TEXT_BACKENDS[backend](pdf)
+
+def extract_expenses_from_pdf(pdf_path, backend=None):
+    """Extract expense transactions from PDF statement using text extraction"""
+    try:
+        print(f"Opening PDF: {pdf_path if isinstance(pdf_path, (str, os.PathLike)) else 'uploaded buffer'}")
+        full_text = extract_text_from_pdf(pdf_path, backend)
+        print(f"Extracted {len(full_text)} characters of text")
+        return parse_statement_text(full_text)
     except Exception as e:
         print(f"Error extracting from PDF: {e}")
         raise
+
+def parse_statement_text(full_text):
+    """Parse expense transactions out of extracted statement text"""
+    expenses = []
+    
+    # Find all transaction matches
+    matches = TRANSACTION_PATTERN.findall(full_text)
+    matches_alt = TRANSACTION_PATTERN_ALT.findall(full_text)
+    
+    # Combine matches, preferring the first pattern
+    seen_matches = set(matches)
+    all_matches = matches + [m for m in matches_alt if m not in seen_matches]
     
+    seen_transactions = set()
+    
+    for match in all_matches:
+        if len(match) < 3:
+            continue
+        
+        posting_date = match[0].strip()
+        # The alternative pattern leaves the "AED" amount prefix on the description;
+        # drop it so both patterns' matches for a line dedupe to one transaction
+        description = TRAILING_CURRENCY_PATTERN.sub('', match[1].strip())
+        amount_str = match[2].strip()
+        
+        # Skip empty or invalid entries
+        if not posting_date or not description or not amount_str:
+            continue
+        
+        # Skip header-like rows
+        description_lower = description.lower()
+        if any(keyword in description_lower for keyword in SKIP_KEYWORDS):
+            continue
+        
+        # Skip credits (amounts with CR or negative)
+        if ' CR' in amount_str.upper() or amount_str.upper().strip().endswith('CR'):
+            continue
+        
+        # Validate date format
+        if not DATE_PATTERN.match(posting_date):
+            continue
+        
+        # Clean and parse amount
+        amount_clean = re.sub(r'[^\d.,-]', '', amount_str)
+        amount_clean = amount_clean.replace(',', '').strip()
+        
+        if not amount_clean:
+            continue
+        
+        try:
+            amount_float = float(amount_clean)
+            if amount_float <= 0:
+                continue
+            
+            # Clean description
+            description_clean = ' '.join(description.split())
+            
+            # Skip if description is too short
+            if len(description_clean) < 3:
+                continue
+            
+            # Create transaction key to avoid duplicates
+            transaction_key = (posting_date, description_clean, amount_float)
+            if transaction_key in seen_transactions:
+                continue
+            seen_transactions.add(transaction_key)
+            
+            expenses.append({
+                'date': posting_date,
+                'description': description_clean,
+                'amount': amount_float
+            })
+        except (ValueError, AttributeError):
+            continue
+    
+    # If no transactions found with regex, try line-by-line parsing
+    if not expenses:
+        lines = full_text.split('\n')
+        current_date = None
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            
+            # Check if line starts with a date
+            date_match = DATE_PATTERN.match(line)
+            if date_match:
+                current_date = date_match.group(1)
+                # Try to extract amount from same line
+                amount_match = re.search(r'([\d,]+\.?\d{2})', line)
+                if amount_match:
+                    desc_part = line[len(date_match.group(0)):amount_match.start()].strip()
+                    amount_str = amount_match.group(1)
+                    if desc_part and len(desc_part) > 3:
+                        try:
+                            amount_float = float(amount_str.replace(',', ''))
+                            if amount_float > 0 and 'CR' not in line.upper():
+                                expenses.append({
+                                    'date': current_date,
+                                    'description': desc_part,
+                                    'amount': amount_float
+                                })
+                        except ValueError:
+                            pass
+
     return expenses
 
 def clean_description(description):
@@ -262,8 +915,100 @@ def clean_description(description):
     desc = re.sub(r'^(NFC|IAP)\s*-\s*\([^)]+\)\s*-\s*', '', desc, flags=re.IGNORECASE)
     return desc.strip()
 
+# Merchant normalization
+# The same merchant shows up with different branch names, store numbers, card
+# suffixes, cities and payment gateway prefixes. merchant_key() reduces these
+# to one stable key used by the keyword rules, the category cache and batching.
+PAYMENT_GATEWAY_PREFIXES = [
+    'SQ', 'SQU', 'PAYPAL', 'PP', 'TST', 'SP', 'SUMUP', 'IZ', 'ZETTLE', 'PAYTABS', 'PAYFORT',
+    'CHECKOUT', 'CKO', 'STRIPE', 'NI', 'NETWORK INTL', 'TELR', 'TABBY', 'TAMARA',
+]
+PAYMENT_METHOD_PREFIXES = [
+    'POS PURCHASE', 'POS', 'PURCHASE', 'ECOM', 'E-COM', 'ONLINE', 'APPLE PAY', 'AP-PAY',
+    'GOOGLE PAY', 'G-PAY', 'SAMSUNG PAY', 'CONTACTLESS',
+]
+# Cities, countries, malls and districts; only stripped after the first word
+LOCATION_TOKENS = [
+    'DUBAI', 'ABU DHABI', 'SHARJAH', 'AJMAN', 'FUJAIRAH', 'RAS AL KHAIMAH', 'RAK', 'UMM AL QUWAIN',
+    'AL AIN', 'AUH', 'DXB', 'SHJ', 'UAE', 'AE', 'ARE', 'UNITED ARAB EMIRATES',
+    'MOE', 'MALL OF THE EMIRATES', 'CITY CENTRE', 'CITY CENTER', 'DUBAI MALL', 'DUBAI FESTIVAL CITY',
+    'FESTIVAL CITY', 'IBN BATTUTA', 'MARINA', 'MARINA WALK', 'MARINA MALL', 'JLT', 'JBR', 'DIFC',
+    'AL BARSHA', 'BARSHA', 'DEIRA', 'BUR DUBAI', 'MIRDIF', 'KARAMA', 'JUMEIRAH', 'BUSINESS BAY',
+    'DOWNTOWN', 'SILICON OASIS', 'SPORTS CITY', 'MOTOR CITY', 'AL QUOZ', 'AL NAHDA', 'KHALIFA CITY',
+]
+# Merchants whose services share a name; "UBER *EATS" is food, "UBER *TRIP" is transport
+MULTI_BRAND_MERCHANTS = {'UBER', 'CAREEM', 'AMAZON', 'AMZN', 'GOOGLE', 'APPLE', 'NOON'}
+LEGAL_SUFFIXES = ['LLC', 'L.L.C', 'L.L.C.', 'FZ-LLC', 'FZLLC', 'FZE', 'FZCO', 'LTD', 'CO', 'BRANCH', 'BR']
+
+def _phrase_pattern(phrases):
+    # Longest first so 'DUBAI MALL' wins over 'DUBAI'
+    alternatives = '|'.join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+    return re.compile(rf'(?<![\w.])(?:{alternatives})(?![\w-])', re.IGNORECASE)
+
+_GATEWAY_PATTERN = re.compile(
+    r'^(?:' + '|'.join(re.escape(p) for p in PAYMENT_GATEWAY_PREFIXES) + r')\s*\*\s*', re.IGNORECASE
+)
+_METHOD_PATTERN = re.compile(
+    r'^(?:' + '|'.join(re.escape(p) for p in sorted(PAYMENT_METHOD_PREFIXES, key=len, reverse=True)) + r')\b[\s:*-]*',
+    re.IGNORECASE
+)
+_CARD_SUFFIX_PATTERN = re.compile(r'\b(?:CARD|CRD)\s*(?:NO\.?)?\s*[X*]*\d{4}\b|[X*]{4,}\d{0,4}\b', re.IGNORECASE)
+_STORE_NUMBER_PATTERN = re.compile(
+    r'#\s*\d+|\b(?:STORE|BRANCH|BR|NO)\.?\s*\d+\b|(?<![\w-])(?:[A-Z]{0,3}\d{3,}|\d+)(?![\w-])', re.IGNORECASE
+)
+_DOMAIN_SUFFIX_PATTERN = re.compile(r'\.(?:COM|AE|NET|ORG|CO|IO)\b(?:\.\w{2})?', re.IGNORECASE)
+_LOCATION_PATTERN = _phrase_pattern(LOCATION_TOKENS)
+_LEGAL_SUFFIX_PATTERN = _phrase_pattern(LEGAL_SUFFIXES)
+
+@functools.lru_cache(maxsize=65536)
+def merchant_key(description):
+    """Stable lowercase merchant key, e.g. 'CARREFOUR MOE 1234 DUBAI' -> 'carrefour'"""
+    desc = clean_description(description)
+    # Gateway prefixes ("SQ *SHOP") name the processor, not the merchant
+    previous = None
+    while previous != desc:
+        previous = desc
+        desc = _GATEWAY_PATTERN.sub('', desc)
+        desc = _METHOD_PATTERN.sub('', desc)
+    # "UBER *TRIP HELP.UBER.COM": the merchant is before the star, except for
+    # multi-brand merchants where the next word names the service ("UBER *EATS")
+    if '*' in desc:
+        head, _, tail = desc.partition('*')
+        head = head.strip()
+        service = _DOMAIN_SUFFIX_PATTERN.sub(' ', tail).split()[:1]
+        if _DOMAIN_SUFFIX_PATTERN.sub('', head).upper() in MULTI_BRAND_MERCHANTS and service and service[0].isalpha():
+            desc = f"{head} {service[0]}"
+        elif head:
+            desc = head
+    desc = _CARD_SUFFIX_PATTERN.sub(' ', desc)
+    desc = _DOMAIN_SUFFIX_PATTERN.sub(' ', desc)
+    desc = re.sub(r'[-/,_()\[\]:;"]+', ' ', desc)
+    desc = ' '.join(desc.split())
+    
+    # A short leading number is part of the name ('7 ELEVEN', '24 SEVEN'),
+    # longer ones are terminal or store IDs
+    lead, _, rest = desc.partition(' ')
+    if lead.isdigit() and len(lead) <= 3 and rest:
+        desc = rest
+    else:
+        lead = ''
+    desc = ' '.join(_STORE_NUMBER_PATTERN.sub(' ', desc).split())
+    
+    # Keep the first word so e.g. 'DUBAI METRO' and 'DUBAI MALL' survive
+    first, _, rest = desc.partition(' ')
+    first = f"{lead} {first}"
+    rest = _LOCATION_PATTERN.sub(' ', rest)
+    rest = _LEGAL_SUFFIX_PATTERN.sub(' ', rest)
+    key = ' '.join(f"{first} {rest}".split()).strip(' .&').lower()
+    return key or ' '.join(clean_description(description).split()).lower()
+
 def categorize_expense_with_claude(description):
     """Categorize an expense using Claude API"""
+    cache_key = _category_cache_key(description)
+    cached = state_get('category', cache_key)
+    if cached in CATEGORIES:
+        return cached
+    
     cleaned_desc = clean_description(description)
     categories_str = ', '.join(CATEGORIES)
     
@@ -304,25 +1049,43 @@ Respond with ONLY the exact category name from the list above, nothing else."""
             }]
         }
         
-        response = requests.post(CLAUDE_API_URL, headers=headers, json=data, timeout=10)
+        response = post_to_claude(headers, data, timeout=10)
         response.raise_for_status()
         
         result = response.json()
         category = result['content'][0]['text'].strip()
         
         # Validate category is in our list
-        if category in CATEGORIES:
-            return category
-        else:
+        if category not in CATEGORIES:
             # Try to find a match (case-insensitive, partial)
             for cat in CATEGORIES:
                 if cat.lower() == category.lower() or cat.lower() in category.lower() or category.lower() in cat.lower():
-                    return cat
-            return 'Other'
+                    category = cat
+                    break
+            else:
+                category = 'Other'
+        state_set('category', cache_key, category)
+        return category
+    except TimeoutError:
+        # Out of rate-limit capacity or time; callers stop calling per transaction
+        raise
     except Exception as e:
         print(f"Error categorizing with Claude: {e}")
         return 'Other'
 
+def categorize_individually(expenses, indices):
+    """Categorize expenses one call at a time, giving up (as 'Other') once the rate limiter times out"""
+    categorized = {}
+    for n, expense_idx in enumerate(indices):
+        try:
+            categorized[expense_idx] = categorize_expense_with_claude(expenses[expense_idx]['description'])
+        except TimeoutError as e:
+            print(f"Error categorizing with Claude: {e}")
+            for remaining_idx in indices[n:]:
+                categorized[remaining_idx] = 'Other'
+            break
+    return categorized
+
 def categorize_expenses_batch(expenses, batch_size=50):
     """Categorize multiple expenses using Claude API in smaller batches"""
     if not expenses:
@@ -334,13 +1097,29 @@ def categorize_expenses_batch(expenses, batch_size=50):
         batch_size = 50  # Larger batches for speed
     
     all_categorized = {}
-    total_batches = (len(expenses) + batch_size - 1) // batch_size
+    
+    # Reuse categories already decided by any worker
+    cache_keys = [_category_cache_key(exp['description']) for exp in expenses]
+    cached = state_get_many('category', cache_keys)
+    # Only one transaction per merchant is sent; the rest copy its category
+    pending = []
+    same_merchant = defaultdict(list)
+    for expense_idx, cache_key in enumerate(cache_keys):
+        if cached.get(cache_key) in CATEGORIES:
+            all_categorized[expense_idx] = cached[cache_key]
+        else:
+            if cache_key not in same_merchant:
+                pending.append(expense_idx)
+            same_merchant[cache_key].append(expense_idx)
+    print(f"Category cache: {len(all_categorized)} hits, {len(pending)} unique merchants to categorize")
+    
+    total_batches = (len(pending) + batch_size - 1) // batch_size
     
     # Process in smaller batches to avoid token limits and improve accuracy
-    for batch_num, batch_start in enumerate(range(0, len(expenses), batch_size), 1):
+    for batch_num, batch_start in enumerate(range(0, len(pending), batch_size), 1):
         print(f"Processing batch {batch_num}/{total_batches}...")
-        batch_expenses = expenses[batch_start:batch_start + batch_size]
-        batch_indices = list(range(batch_start, batch_start + len(batch_expenses)))
+        batch_indices = pending[batch_start:batch_start + batch_size]
+        batch_expenses = [expenses[i] for i in batch_indices]
         
         # Clean descriptions
         transactions_text = "\n".join([
@@ -388,7 +1167,7 @@ Use exact category names from the list. Only respond with valid JSON, no other t
                 }]
             }
             
-            response = requests.post(CLAUDE_API_URL, headers=headers, json=data, timeout=60)
+            response = post_to_claude(headers, data, timeout=60)
             response.raise_for_status()
             
             result = response.json()
@@ -440,27 +1219,38 @@ Use exact category names from the list. Only respond with valid JSON, no other t
                         if not matched:
                             category = 'Other'
                     all_categorized[expense_idx] = category
+                state_set_many('category', {cache_keys[i]: all_categorized[i] for i in batch_indices})
             except (json.JSONDecodeError, KeyError) as e:
                 print(f"Error parsing batch response: {e}")
                 # Fallback: categorize individually for this batch
-                for expense_idx in batch_indices:
-                    all_categorized[expense_idx] = categorize_expense_with_claude(expenses[expense_idx]['description'])
+                all_categorized.update(categorize_individually(expenses, batch_indices))
                 
+        except TimeoutError as e:
+            # Still rate limited after retries, or out of time; individual calls would wait again
+            print(f"Error categorizing batch with Claude: {e}")
+            for expense_idx in batch_indices:
+                all_categorized[expense_idx] = 'Other'
         except Exception as e:
             print(f"Error categorizing batch with Claude: {e}")
             # Fallback: categorize individually for this batch
-            for expense_idx in batch_indices:
-                all_categorized[expense_idx] = categorize_expense_with_claude(expenses[expense_idx]['description'])
+            all_categorized.update(categorize_individually(expenses, batch_indices))
+    
+    for expense_idx in pending:
+        for other_idx in same_merchant[cache_keys[expense_idx]]:
+            all_categorized[other_idx] = all_categorized.get(expense_idx, 'Other')
     
     return all_categorized
 
 def process_statement(pdf_path):
-    """Process PDF statement and return categorized expenses"""
-    print(f"Starting to process statement: {pdf_path}")
+    """Process PDF statement (path or readable binary buffer) and return categorized expenses"""
+    print(f"Starting to process statement: {pdf_path if isinstance(pdf_path, (str, os.PathLike)) else 'uploaded buffer'}")
     
     expenses = extract_expenses_from_pdf(pdf_path)
     print(f"Extracted {len(expenses)} expenses from PDF")
-    
+    return categorize_statement(expenses)
+
+def categorize_statement(expenses):
+    """Categorize extracted expenses and return the per-category result"""
     if not expenses:
         return {
             'categories': {},
@@ -468,93 +1258,72 @@ def process_statement(pdf_path):
             'total_transactions': 0
         }
     
-    # Limit processing to first 300 transactions to avoid Render timeout (30s limit)
+    # Every transaction is kept; Claude time is bounded by the upload's budget
+    # (CLAUDE_UPLOAD_BUDGET_SECONDS) and anything left over becomes 'Other'
+    keyword_first = False
     if len(expenses) > 300:
-        print(f"Large statement ({len(expenses)} transactions). Processing first 300 only to avoid timeout.")
-        expenses = expenses[:300]
-        
         # For very large statements, use keyword-based categorization first
         # Then use Claude API only for uncategorized transactions
-        if len(expenses) > 200:
-            print(f"Large statement ({len(expenses)} transactions). Using hybrid approach...")
-        categorized = defaultdict(lambda: {'total': 0.0, 'transactions': []})
-        uncategorized = []
-        uncategorized_indices = []
-        
-        # Quick keyword-based categorization
-        keyword_categories = {
-            'food': 'Food & Dining',
-            'restaurant': 'Food & Dining',
-            'cafe': 'Food & Dining',
-            'carrefour': 'Food & Dining',
-            'lulu': 'Food & Dining',
-            'supermarket': 'Food & Dining',
-            'grocery': 'Food & Dining',
-            'uber': 'Transportation',
-            'careem': 'Transportation',
-            'taxi': 'Transportation',
-            'metro': 'Transportation',
-            'amazon': 'Shopping',
-            'shopping': 'Shopping',
-            'mall': 'Shopping',
-            'pharmacy': 'Healthcare',
-            'hospital': 'Healthcare',
-            'medical': 'Healthcare',
-            'salon': 'Personal Care',
-            'gym': 'Personal Care',
-            'fitness': 'Personal Care',
-            'etisalat': 'Bills & Utilities',
-            'du': 'Bills & Utilities',
-            'dewa': 'Bills & Utilities',
-            'utility': 'Bills & Utilities',
-        }
-        
-        for i, expense in enumerate(expenses):
-            desc_lower = expense['description'].lower()
-            categorized_flag = False
-            
-            for keyword, category in keyword_categories.items():
-                if keyword in desc_lower:
-                    categorized[category]['total'] += expense['amount']
-                    categorized[category]['transactions'].append(expense)
-                    categorized_flag = True
-                    break
-            
-            if not categorized_flag:
-                uncategorized.append(expense)
-                uncategorized_indices.append(i)
-        
-        print(f"Keyword categorization: {len(expenses) - len(uncategorized)} categorized, {len(uncategorized)} need API")
-        
-        # Use Claude API only for uncategorized transactions
-        if uncategorized:
-            batch_categories = categorize_expenses_batch(uncategorized, batch_size=50)
-            for i, expense in enumerate(uncategorized):
-                category = batch_categories.get(i, 'Other')
-                categorized[category]['total'] += expense['amount']
-                categorized[category]['transactions'].append(expense)
-    else:
-        # Try batch categorization first (more efficient)
-        print(f"Using batch categorization for {len(expenses)} transactions...")
-        batch_categories = categorize_expenses_batch(expenses)
+        print(f"Large statement ({len(expenses)} transactions). Using hybrid approach...")
+        keyword_first = True
+    
+    categories = categorize_expenses(expenses, keyword_first=keyword_first)
+    return build_category_result(expenses, categories)
+
+def keyword_category(description):
+    """Quick keyword-based categorization, or None if no keyword matches"""
+    # Whole words only, so e.g. 'du' doesn't fire on 'DUBAI DUTY FREE'. The merchant
+    # is tried first; the full description still carries hints like 'DUBAI MALL'
+    for text in (merchant_key(description), clean_description(description)):
+        words = f" {' '.join(re.findall(r'[a-z0-9&]+', text.lower()))} "
+        for keyword, category in KEYWORD_CATEGORIES.items():
+            if f" {keyword} " in words:
+                return category
+    return None
+
+def categorize_expenses(expenses, keyword_first=False, use_claude=True):
+    """Return a category for every expense, in order.
+    
+    Tiers: keywords (when keyword_first), then the shared category cache and
+    Claude batches, then individual Claude calls if batching returns nothing.
+    With use_claude=False anything not covered by keywords or the cache is 'Other'.
+    """
+    categories = [None] * len(expenses)
+    pending = list(range(len(expenses)))
+    
+    if keyword_first:
+        for i in pending:
+            categories[i] = keyword_category(expenses[i]['description'])
+        pending = [i for i in pending if categories[i] is None]
+        print(f"Keyword categorization: {len(expenses) - len(pending)} categorized, {len(pending)} need API")
     
-        categorized = defaultdict(lambda: {'total': 0.0, 'transactions': []})
+    if pending and not use_claude:
+        cached = state_get_many('category', [_category_cache_key(expenses[i]['description']) for i in pending])
+        for i in pending:
+            categories[i] = cached.get(_category_cache_key(expenses[i]['description']), 'Other')
+    elif pending:
+        # Try batch categorization first (more efficient)
+        print(f"Using batch categorization for {len(pending)} transactions...")
+        pending_expenses = [expenses[i] for i in pending]
+        batch_categories = categorize_expenses_batch(pending_expenses, batch_size=50)
         
         if batch_categories:
-            # Use batch results
-            for i, expense in enumerate(expenses):
-                category = batch_categories.get(i, 'Other')
-                categorized[category]['total'] += expense['amount']
-                categorized[category]['transactions'].append(expense)
+            for j, i in enumerate(pending):
+                categories[i] = batch_categories.get(j, 'Other')
         else:
             # Fallback to individual categorization
             print("Falling back to individual categorization...")
-            for i, expense in enumerate(expenses):
-                if i % 50 == 0:
-                    print(f"Processing transaction {i+1}/{len(expenses)}...")
-                category = categorize_expense_with_claude(expense['description'])
-                categorized[category]['total'] += expense['amount']
-                categorized[category]['transactions'].append(expense)
+            for i, category in categorize_individually(expenses, pending).items():
+                categories[i] = category
+    
+    return categories
+
+def build_category_result(expenses, categories):
+    """Group expenses by category into the response shape used by /upload"""
+    categorized = defaultdict(lambda: {'total': 0.0, 'transactions': []})
+    for expense, category in zip(expenses, categories):
+        categorized[category]['total'] += expense['amount']
+        categorized[category]['transactions'].append(expense)
     
     # Convert to regular dict and sort by total
     result = {
@@ -566,6 +1335,309 @@ def process_statement(pdf_path):
     print(f"Processing complete. Returning {len(result['categories'])} categories")
     return result
 
+# Transaction query indexes
+# Built lazily per result and per worker from the stored result: dates and
+# amounts as sorted arrays for bisect range queries, plus an inverted index of
+# description tokens (with a sorted vocabulary for prefix matches).
+TRANSACTION_INDEX_CACHE_SIZE = int(os.environ.get('TRANSACTION_INDEX_CACHE_SIZE', 32))
+_TOKEN_PATTERN = re.compile(r'[a-z0-9&]+')
+
+_transaction_indexes = OrderedDict()
+_transaction_indexes_lock = threading.Lock()
+
+def parse_statement_date(value):
+    """Parse a statement date ('08-Oct-24') or ISO date ('2024-10-08') to a date ordinal"""
+    for fmt in ('%d-%b-%y', '%Y-%m-%d', '%d-%b-%Y'):
+        try:
+            return datetime.strptime(value.strip(), fmt).toordinal()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {value!r} (use DD-MMM-YY or YYYY-MM-DD)")
+
+def _description_tokens(description):
+    return set(_TOKEN_PATTERN.findall(description.lower())) | set(_TOKEN_PATTERN.findall(merchant_key(description)))
+
+def _ranks(order):
+    ranks = [0] * len(order)
+    for position, i in enumerate(order):
+        ranks[i] = position
+    return ranks
+
+def build_transaction_index(result, expires_at=None):
+    """Index every transaction of a /upload result for date, amount, text and category queries"""
+    transactions = []
+    by_category = defaultdict(list)
+    for category, info in result.get('categories', {}).items():
+        for transaction in info.get('transactions', []):
+            by_category[category].append(len(transactions))
+            transactions.append({**transaction, 'category': category})
+    
+    dated = []
+    tokens = defaultdict(list)
+    # Statements repeat the same dates and descriptions many times
+    date_ordinals = {}
+    description_tokens = {}
+    for i, transaction in enumerate(transactions):
+        date = transaction.get('date', '')
+        if date not in date_ordinals:
+            try:
+                date_ordinals[date] = parse_statement_date(date)
+            except ValueError:
+                date_ordinals[date] = None
+        if date_ordinals[date] is not None:
+            dated.append((date_ordinals[date], i))
+        description = transaction.get('description', '')
+        if description not in description_tokens:
+            description_tokens[description] = _description_tokens(description)
+        for token in description_tokens[description]:
+            tokens[token].append(i)
+    dated.sort()
+    date_ids = [i for _, i in dated]
+    dated_set = set(date_ids)
+    # Undated transactions sort after dated ones
+    date_order = date_ids + [i for i in range(len(transactions)) if i not in dated_set]
+    amounts = [transaction.get('amount', 0) for transaction in transactions]
+    by_amount = sorted(range(len(transactions)), key=amounts.__getitem__)
+    
+    return {
+        'transactions': transactions,
+        'amounts': amounts,
+        'expires_at': expires_at,
+        # Sort orders by key; date and amount ranges are slices of these
+        'order': {
+            'date': date_order,
+            'amount': by_amount,
+        },
+        'keys': {
+            'date': [d for d, _ in dated],
+            'amount': [amounts[i] for i in by_amount],
+        },
+        'rank': {
+            'date': _ranks(date_order),
+            'amount': _ranks(by_amount),
+        },
+        # Prefix sums of the amounts in each order, for range totals without a scan
+        'amount_sums': {
+            'date': list(itertools.accumulate((amounts[i] for i in date_order), initial=0)),
+            'amount': list(itertools.accumulate((amounts[i] for i in by_amount), initial=0)),
+        },
+        'tokens': dict(tokens),
+        'vocabulary': sorted(tokens),
+        'categories': {category.lower(): ids for category, ids in by_category.items()},
+        'category_of': [transaction['category'].lower() for transaction in transactions],
+    }
+
+def get_transaction_index(result_id):
+    """Index for a stored result, cached per worker; None if the result is missing or expired"""
+    with _transaction_indexes_lock:
+        index = _transaction_indexes.get(result_id)
+        if index is not None:
+            if index['expires_at'] is not None and index['expires_at'] <= time.time():
+                del _transaction_indexes[result_id]
+                return None
+            _transaction_indexes.move_to_end(result_id)
+            return index
+    entry = state_get_many('result', [result_id], with_expiry=True).get(result_id)
+    if entry is None:
+        return None
+    index = build_transaction_index(*entry)
+    with _transaction_indexes_lock:
+        _transaction_indexes[result_id] = index
+        while len(_transaction_indexes) > TRANSACTION_INDEX_CACHE_SIZE:
+            _transaction_indexes.popitem(last=False)
+    return index
+
+def _range_positions(keys, low, high):
+    """Slice [start, end) of a sorted key list with low <= key <= high"""
+    start = bisect.bisect_left(keys, low) if low is not None else 0
+    end = bisect.bisect_right(keys, high) if high is not None else len(keys)
+    return start, end
+
+def _text_ids(index, text):
+    """Transactions containing every query word (each word also matches as a prefix)"""
+    matched = None
+    vocabulary = index['vocabulary']
+    for word in _TOKEN_PATTERN.findall(text.lower()):
+        ids = set()
+        # Vocabulary entries starting with word form a contiguous sorted run
+        for position in range(bisect.bisect_left(vocabulary, word), len(vocabulary)):
+            token = vocabulary[position]
+            if not token.startswith(word):
+                break
+            ids.update(index['tokens'][token])
+        matched = ids if matched is None else matched & ids
+        if not matched:
+            break
+    return matched
+
+def _keep(ids, allowed, values=None):
+    """ids whose value (values[i], or i itself) is in allowed, filtered without a Python loop"""
+    checked = map(values.__getitem__, ids) if values is not None else ids
+    return list(itertools.compress(ids, map(allowed.__contains__, checked)))
+
+def query_transactions(index, date_from=None, date_to=None, min_amount=None, max_amount=None,
+                       text=None, category=None, sort='date', limit=100, offset=0):
+    """Filter an indexed result; every filter is optional and they are combined with AND"""
+    key = sort.lstrip('-')
+    descending = sort.startswith('-')
+    order = index['order'][key]
+    rank = index['rank'][key]
+    # Ids ranked below this have a sort value; undated transactions come last either way
+    ranked = len(index['keys'][key])
+    
+    # Date and amount ranges are (start, end) slices of their sort order
+    ranges = {}
+    if date_from is not None or date_to is not None:
+        ranges['date'] = _range_positions(index['keys']['date'], date_from, date_to)
+    if min_amount is not None or max_amount is not None:
+        ranges['amount'] = _range_positions(index['keys']['amount'], min_amount, max_amount)
+    words = _text_ids(index, text) if text else None
+    category = category.lower() if category else None
+    
+    start, end = ranges.pop(key, (0, len(order)))
+    transactions = index['transactions']
+    if not ranges and words is None and category is None:
+        # One slice of the sort order: totals from prefix sums, only the page is built
+        sums = index['amount_sums'][key]
+        count = end - start
+        page = range(offset, min(offset + limit, count))
+        if not descending:
+            ids = order[start + offset:start + offset + len(page)]
+        else:
+            # Ranked positions in reverse, then undated ones in order
+            last_ranked = min(end, ranked)
+            dated = max(0, last_ranked - start)
+            ids = [order[last_ranked - 1 - k] if k < dated else order[max(start, ranked) + k - dated] for k in page]
+        return {
+            'total_matches': count,
+            'total_amount': sums[end] - sums[start],
+            'transactions': [transactions[i] for i in ids],
+        }
+    
+    # Walk the smallest candidate list and check the other filters per id. The
+    # sort-order slice is preferred while it is not much larger, as it needs no sort.
+    sizes = [other_end - other_start for other_start, other_end in ranges.values()]
+    if words is not None:
+        sizes.append(len(words))
+    if category is not None:
+        sizes.append(len(index['categories'].get(category, [])))
+    smallest = min(sizes)
+    presorted = end - start <= 2 * smallest
+    if presorted:
+        matches = order[start:end]
+    elif words is not None and len(words) == smallest:
+        matches = list(words)
+        words = None
+    elif category is not None and len(index['categories'].get(category, [])) == smallest:
+        matches = index['categories'].get(category, [])
+        category = None
+    else:
+        other_key = min(ranges, key=lambda k: ranges[k][1] - ranges[k][0])
+        other_start, other_end = ranges.pop(other_key)
+        matches = index['order'][other_key][other_start:other_end]
+    if not presorted and (start, end) != (0, len(order)):
+        # The sort key's own range still has to hold
+        matches = _keep(matches, range(start, end), rank)
+    for other_key, (other_start, other_end) in ranges.items():
+        matches = _keep(matches, range(other_start, other_end), index['rank'][other_key])
+    if words is not None:
+        matches = _keep(matches, words)
+    if category is not None:
+        matches = _keep(matches, {category}, index['category_of'])
+    
+    if not presorted:
+        matches = sorted(matches, key=rank.__getitem__)
+    if descending:
+        # Reverse the ranked part only, so undated transactions stay last
+        split = bisect.bisect_left(matches, ranked, key=rank.__getitem__)
+        page = (matches[:split][::-1] + matches[split:])[offset:offset + limit]
+    else:
+        page = matches[offset:offset + limit]
+    amounts = index['amounts']
+    return {
+        'total_matches': len(matches),
+        'total_amount': sum(map(amounts.__getitem__, matches)),
+        'transactions': [transactions[i] for i in page],
+    }
+
+# On-demand request profiling
+# Admins send X-Profile-Token (matching PROFILING_TOKEN) with /upload or /export;
+# the request's thread is then sampled and the stacks are stored with the result
+# id in collapsed format for flamegraph.pl, speedscope or inferno.
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+def _profiling_authorized(token):
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+def _frame_label(frame):
+    # Module names keep e.g. Flask's flask/app.py apart from this app.py
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f"{code.co_name} ({module}:{code.co_firstlineno})"
+
+@contextlib.contextmanager
+def sample_stacks(counts, interval=PROFILE_SAMPLE_INTERVAL):
+    """Sample the calling thread's stack until the block exits, counting collapsed stacks"""
+    target = threading.get_ident()
+    stop = threading.Event()
+    
+    def sampler():
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                counts[';'.join(reversed(stack))] += 1
+    
+    thread = threading.Thread(target=sampler, name='profile-sampler', daemon=True)
+    thread.start()
+    try:
+        yield counts
+    finally:
+        stop.set()
+        thread.join()
+
+def profiled(kind):
+    """Profile a view when a valid X-Profile-Token is sent; the profile id is returned in X-Profile-Id"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = request.headers.get('X-Profile-Token')
+            if token is None:
+                return view(*args, **kwargs)
+            if not _profiling_authorized(token):
+                return jsonify({'error': 'Profiling is not enabled or the token is invalid'}), 403
+            
+            counts = defaultdict(int)
+            started = time.perf_counter()
+            with sample_stacks(counts):
+                response = app.make_response(view(*args, **kwargs))
+            duration = time.perf_counter() - started
+            
+            # Uploads return their result id; exports carry it in the posted data
+            if kind == 'upload':
+                result_id = (response.get_json(silent=True) or {}).get('result_id')
+            else:
+                result_id = (request.get_json(silent=True) or {}).get('result_id')
+            # A result can be exported (and profiled) many times; keep every profile
+            profile_id = f"{result_id or 'unknown'}-{kind}-{uuid.uuid4().hex[:8]}"
+            state_set('profile', profile_id, {
+                'kind': kind,
+                'result_id': result_id,
+                'duration': duration,
+                'interval': PROFILE_SAMPLE_INTERVAL,
+                'samples': sum(counts.values()),
+                'stacks': dict(counts),
+            }, ttl=RESULT_TTL_SECONDS)
+            print(f"Stored {kind} profile {profile_id}: {duration:.2f}s, {sum(counts.values())} samples")
+            response.headers['X-Profile-Id'] = profile_id
+            return response
+        return wrapper
+    return decorator
+
 @app.route('/')
 def index():
     try:
@@ -607,7 +1679,9 @@ def health():
     try:
         return jsonify({
             'status': 'ok',
-            'pypdf': pypdf is not None,
+            'pypdf': PdfReader is not None,
+            'pdf_backends': list(PDF_TEXT_BACKENDS),
+            'pdf_backend_selected': _selected_pdf_backend,
             'openpyxl': Workbook is not None,
             'vercel': IS_VERCEL,
             'claude_api_key_set': bool(os.environ.get('CLAUDE_API_KEY')),
@@ -622,6 +1696,7 @@ def health():
         }), 500
 
 @app.route('/upload', methods=['POST'])
+@profiled('upload')
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -633,26 +1708,22 @@ def upload_file():
     if not file.filename.lower().endswith('.pdf'):
         return jsonify({'error': 'Please upload a PDF file'}), 400
     
-    filepath = None
+    job_id = str(uuid.uuid4())
+    set_job_status(job_id, 'processing', filename=file.filename)
+    set_claude_owner(job_id, budget_seconds=CLAUDE_UPLOAD_BUDGET_SECONDS)
     try:
-        # Ensure upload directory exists
-        upload_dir = app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Use a unique filename to avoid conflicts
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        filepath = os.path.join(upload_dir, unique_filename)
-        
-        # Save uploaded file
-        file.save(filepath)
-        print(f"File saved to: {filepath}")
-        
-        # Process the statement
-        result = process_statement(filepath)
+        # Extract straight from the spooled buffer (no save/reopen/delete), and
+        # release it before the slow Claude calls
+        with pdf_buffer(file.stream) as buffer:
+            expenses = extract_expenses_from_pdf(buffer)
+        file.close()
+        print(f"Extracted {len(expenses)} expenses from {file.filename}")
+        result = categorize_statement(expenses)
         
-        # Clean up uploaded file
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
+        # Keep the result so any worker can serve it later
+        result['result_id'] = job_id
+        store_result(job_id, result)
+        set_job_status(job_id, 'done', filename=file.filename)
         
         return jsonify(result)
     
@@ -661,20 +1732,97 @@ def upload_file():
         error_trace = traceback.format_exc()
         print(f"Upload error: {error_msg}")
         print(f"Traceback: {error_trace}")
-        
-        # Clean up uploaded file if it exists
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except:
-                pass
+        set_job_status(job_id, 'error', filename=file.filename, error=error_msg)
         
         return jsonify({
             'error': f'Error processing file: {error_msg}',
             'details': error_trace if app.debug else None
         }), 500
+    
+    finally:
+        file.close()
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of an upload, visible from every worker"""
+    status = get_job_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, **status})
+
+@app.route('/results/<result_id>')
+def get_result(result_id):
+    """Return a stored result by id"""
+    result = load_result(result_id)
+    if result is None:
+        return jsonify({'error': 'Result not found or expired'}), 404
+    return jsonify(result)
+
+@app.route('/results/<result_id>/transactions')
+def search_transactions(result_id):
+    """Query a stored result by date range, amount range, description text and category.
+    
+    Parameters: date_from, date_to (DD-MMM-YY or YYYY-MM-DD), min_amount, max_amount,
+    q (words, prefix match), category, sort (date, -date, amount, -amount), limit (1-1000), offset.
+    Undated transactions are listed last for both date orders.
+    """
+    started = time.perf_counter()
+    args = request.args
+    try:
+        date_from = parse_statement_date(args['date_from']) if args.get('date_from') else None
+        date_to = parse_statement_date(args['date_to']) if args.get('date_to') else None
+        min_amount = float(args['min_amount']) if args.get('min_amount') else None
+        max_amount = float(args['max_amount']) if args.get('max_amount') else None
+        limit = min(max(int(args.get('limit', 100)), 1), 1000)
+        offset = max(int(args.get('offset', 0)), 0)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    sort = args.get('sort', 'date')
+    if sort not in ('date', '-date', 'amount', '-amount'):
+        return jsonify({'error': 'sort must be one of: date, -date, amount, -amount'}), 400
+    
+    index = get_transaction_index(result_id)
+    if index is None:
+        return jsonify({'error': 'Result not found or expired'}), 404
+    
+    response = query_transactions(
+        index, date_from=date_from, date_to=date_to, min_amount=min_amount, max_amount=max_amount,
+        text=args.get('q'), category=args.get('category'), sort=sort, limit=limit, offset=offset
+    )
+    response['result_id'] = result_id
+    response['took_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(response)
+
+@app.route('/profiles/<profile_id>')
+def download_profile(profile_id):
+    """Download a stored profile as collapsed stacks (or ?format=json); needs X-Profile-Token"""
+    if not _profiling_authorized(request.headers.get('X-Profile-Token')):
+        return jsonify({'error': 'Profiling is not enabled or the token is invalid'}), 403
+    profile = state_get('profile', profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found or expired'}), 404
+    if request.args.get('format') == 'json':
+        return jsonify(profile)
+    
+    folded = ''.join(f"{stack} {count}\n" for stack, count in sorted(profile['stacks'].items()))
+    return send_file(
+        io.BytesIO(folded.encode('utf-8')),
+        mimetype='text/plain',
+        as_attachment=True,
+        download_name=f'profile_{profile_id}.folded'
+    )
+
+@app.route('/metrics/claude')
+def claude_metrics():
+    """Claude API queueing delay and rate limiter state"""
+    try:
+        window = int(request.args.get('window', 300))
+        return jsonify(claude_rate_metrics(window)), 200
+    except (ValueError, sqlite3.Error) as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/export', methods=['POST'])
+@profiled('export')
 def export_to_excel():
     """Export categorized expenses to Excel"""
     Workbook_module = _import_openpyxl()
@@ -785,6 +1933,24 @@ def export_to_excel():
     except Exception as e:
         return jsonify({'error': f'Error exporting to Excel: {str(e)}'}), 500
 
+def warm_up():
+    """Prepare shared state once (called from the gunicorn master with --preload).
+    
+    Imports openpyxl, selects the PDF backend and purges expired state. The purge
+    uses its own connection, closed before the workers fork.
+    """
+    _import_openpyxl()
+    select_pdf_text_backend()
+    try:
+        conn = _open_state_db()
+    except sqlite3.Error as e:
+        print(f"Warning: shared state purge failed: {e}")
+        return
+    try:
+        purge_expired_state(conn)
+    finally:
+        conn.close()
+
 # Vercel handler - must be at the very end of the file
 # Vercel Python runtime automatically wraps Flask apps
 # Export the Flask app as 'handler' for Vercel
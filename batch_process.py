@@ -0,0 +1,239 @@
+"""
+Categorize a directory of PDF statements offline and write one combined report
+Usage: python batch_process.py statements/ -o report.xlsx [--workers 4] [--no-claude]
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+
+REPORT_FORMATS = ('csv', 'xlsx', 'json')
+REPORT_COLUMNS = ['File', 'Date', 'Description', 'Amount (AED)', 'Category']
+
+
+def find_pdfs(directory):
+    pdf_paths = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                pdf_paths.append(os.path.join(root, name))
+    return sorted(pdf_paths)
+
+
+def _extract_file(pdf_path, backend):
+    """Process pool worker: returns (path, expenses, error)"""
+    try:
+        # The extractor logs per page; keep the progress bar readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pdf_path, app.extract_expenses_from_pdf(pdf_path, backend), None
+    except Exception as e:
+        return pdf_path, [], str(e)
+
+
+def print_progress(done, total, started, width=30, unit='files'):
+    filled = int(width * done / total) if total else width
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    bar = '#' * filled + '-' * (width - filled)
+    sys.stderr.write(f"\r[{bar}] {done}/{total} {unit}  {rate:.1f} {unit}/s")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+class CategorizeLog(io.TextIOBase):
+    """Stand-in stdout for app.categorize_expenses: shows Claude batches as a
+    progress bar and passes errors, warnings and tier summaries to stderr"""
+    BATCH_PATTERN = re.compile(r'Processing batch (\d+)/(\d+)')
+    SHOWN = ('Error', 'Warning', 'rate limited', 'Falling back', 'Category cache', 'Keyword categorization')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.bar_open = False
+        self.total = 0
+        self._partial = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._partial += text
+        *lines, self._partial = self._partial.split('\n')
+        for line in lines:
+            self._line(line)
+        return len(text)
+
+    def _line(self, line):
+        match = self.BATCH_PATTERN.search(line)
+        if match:
+            done, total = int(match.group(1)), int(match.group(2))
+            # The line is printed before the batch is sent; count finished batches
+            print_progress(done - 1, total, self.started, unit='batches')
+            self.bar_open = True
+            self.total = total
+        elif any(marker in line for marker in self.SHOWN):
+            self.close_bar()
+            sys.stderr.write(f"{line}\n")
+            sys.stderr.flush()
+
+    def close_bar(self):
+        if self.bar_open:
+            sys.stderr.write("\n")
+            self.bar_open = False
+
+    def finish(self):
+        """Complete the bar if the last batch went through without errors"""
+        if self.bar_open:
+            print_progress(self.total, self.total, self.started, unit='batches')
+            self.bar_open = False
+
+
+def extract_all(pdf_paths, workers, base_dir):
+    """Extract expenses from every PDF across a process pool, keeping input order"""
+    # Calibrate once here so workers don't each benchmark the backends
+    with contextlib.redirect_stdout(io.StringIO()):
+        backend = app.select_pdf_text_backend()
+    print(f"Extracting {len(pdf_paths)} PDFs with {workers} workers (backend: {backend})")
+
+    results = {}
+    errors = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_extract_file, path, backend) for path in pdf_paths]
+        for done, future in enumerate(as_completed(futures), 1):
+            path, expenses, error = future.result()
+            results[path] = expenses
+            if error:
+                errors[path] = error
+            print_progress(done, len(pdf_paths), started)
+
+    rows = []
+    for path in pdf_paths:
+        for expense in results.get(path, []):
+            rows.append({**expense, 'file': os.path.relpath(path, base_dir)})
+    return rows, errors
+
+
+def write_csv(rows, output_path):
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+        for row in rows:
+            writer.writerow([row['file'], row['date'], row['description'], f"{row['amount']:.2f}", row['category']])
+
+
+def write_json(rows, summary, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({**summary, 'transactions': rows}, f, indent=2)
+
+
+def write_xlsx(rows, summary, output_path):
+    Workbook = app._import_openpyxl()
+    if Workbook is None:
+        raise RuntimeError("Excel output not available: openpyxl not installed")
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Transactions"
+    header_fill = app.PatternFill(start_color="1E293B", end_color="1E293B", fill_type="solid")
+    header_font = app.Font(bold=True, color="FFFFFF", size=11)
+    for col_num, header in enumerate(REPORT_COLUMNS, 1):
+        cell = ws.cell(row=1, column=col_num, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+    for row in rows:
+        ws.append([row['file'], row['date'], row['description'], row['amount'], row['category']])
+    for row_cells in ws.iter_rows(min_row=2, min_col=4, max_col=4):
+        row_cells[0].number_format = '#,##0.00'
+    for column, width in zip('ABCDE', (40, 12, 50, 15, 20)):
+        ws.column_dimensions[column].width = width
+
+    totals = wb.create_sheet("Summary")
+    totals.append(['Category', 'Total (AED)', 'Transactions'])
+    for category, info in summary['categories'].items():
+        totals.append([category, info['total'], info['count']])
+    totals.append(['TOTAL EXPENSES', summary['total_expenses'], summary['total_transactions']])
+    totals.column_dimensions['A'].width = 22
+    totals.column_dimensions['B'].width = 15
+    wb.save(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Categorize a directory of PDF statements into one report')
+    parser.add_argument('directory', help='Directory to search (recursively) for PDF statements')
+    parser.add_argument('-o', '--output', default='expense_report.csv',
+                        help='Report path; the format is taken from the extension unless --format is given')
+    parser.add_argument('--format', choices=REPORT_FORMATS, help='Report format (csv, xlsx or json)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Extraction processes')
+    parser.add_argument('--no-claude', action='store_true',
+                        help='Only use keyword rules and the shared category cache (no API calls)')
+    args = parser.parse_args()
+
+    report_format = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if report_format not in REPORT_FORMATS:
+        parser.error(f"Unknown report format '{report_format}', use one of: {', '.join(REPORT_FORMATS)}")
+
+    pdf_paths = find_pdfs(args.directory)
+    if not pdf_paths:
+        print(f"No PDF files found in {args.directory}")
+        return 1
+
+    started = time.perf_counter()
+    rows, errors = extract_all(pdf_paths, max(1, args.workers), args.directory)
+    extracted_at = time.perf_counter()
+
+    # Same tiers as /upload, over the whole archive at once so the category
+    # cache and Claude batches are shared between statements
+    print(f"Categorizing {len(rows)} transactions...")
+    log = CategorizeLog()
+    with contextlib.redirect_stdout(log):
+        categories = app.categorize_expenses(rows, keyword_first=True, use_claude=not args.no_claude)
+        result = app.build_category_result(rows, categories)
+    log.finish()
+    for row, category in zip(rows, categories):
+        row['category'] = category
+    categorized_at = time.perf_counter()
+
+    summary = {
+        'files': len(pdf_paths),
+        'failed_files': errors,
+        'total_transactions': len(rows),
+        'total_expenses': result['total_expenses'],
+        'categories': {
+            category: {'total': info['total'], 'count': len(info['transactions'])}
+            for category, info in result['categories'].items()
+        },
+    }
+
+    if report_format == 'csv':
+        write_csv(rows, args.output)
+    elif report_format == 'json':
+        write_json(rows, summary, args.output)
+    else:
+        write_xlsx(rows, summary, args.output)
+    finished = time.perf_counter()
+
+    extract_time = extracted_at - started
+    categorize_time = categorized_at - extracted_at
+    total_time = finished - started
+    print(f"\nWrote {len(rows)} transactions from {len(pdf_paths)} files to {args.output}")
+    for path, error in errors.items():
+        print(f"  Failed: {path}: {error}")
+    print(f"Extraction:     {extract_time:8.2f}s  ({len(pdf_paths) / extract_time if extract_time else 0:.1f} files/s)")
+    print(f"Categorization: {categorize_time:8.2f}s  ({len(rows) / categorize_time if categorize_time else 0:.0f} transactions/s)")
+    print(f"Total:          {total_time:8.2f}s  ({len(rows) / total_time if total_time else 0:.0f} transactions/s)")
+    for category, info in summary['categories'].items():
+        print(f"  {category:<20} AED {info['total']:>12,.2f}  ({info['count']} transactions)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
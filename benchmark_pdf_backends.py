@@ -0,0 +1,73 @@
+"""
+Benchmark the installed PDF text backends on a synthetic statement corpus
+Usage: python benchmark_pdf_backends.py [--sizes 60,300,1500] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import app
+
+
+def run_benchmark(sizes, repeat):
+    corpus = []
+    for seed, size in enumerate(sizes):
+        expected = app.sample_statement_transactions(count=size, seed=seed)
+        corpus.append((size, expected, app.build_sample_statement_pdf(expected)))
+
+    results = {}
+    for name, backend in app.PDF_TEXT_BACKENDS.items():
+        total_time = 0.0
+        total_pages = 0
+        total_transactions = 0
+        accuracies = []
+        for size, expected, pdf_bytes in corpus:
+            best = None
+            text = ''
+            for _ in range(repeat):
+                # Backends log page counts; keep the table readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    started = time.perf_counter()
+                    text = backend(io.BytesIO(pdf_bytes))
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                accuracies.append(app.score_backend_accuracy(expected, app.parse_statement_text(text)))
+            total_time += best
+            total_pages += (size + 44) // 45
+            total_transactions += size
+        results[name] = {
+            'seconds': total_time,
+            'pages_per_sec': total_pages / total_time if total_time else 0.0,
+            'transactions_per_sec': total_transactions / total_time if total_time else 0.0,
+            'accuracy': min(accuracies),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF text extraction backends')
+    parser.add_argument('--sizes', default='60,300,1500',
+                        help='Comma-separated transaction counts for the synthetic statements')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per statement (best time is kept)')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    if not app.PDF_TEXT_BACKENDS:
+        print("No PDF backends installed")
+        return
+
+    results = run_benchmark(sizes, args.repeat)
+    print(f"\n{'Backend':<12} {'Time (s)':>10} {'Pages/s':>10} {'Txns/s':>10} {'Accuracy':>10}")
+    for name, r in sorted(results.items(), key=lambda item: item[1]['seconds']):
+        print(f"{name:<12} {r['seconds']:>10.3f} {r['pages_per_sec']:>10.1f} "
+              f"{r['transactions_per_sec']:>10.0f} {r['accuracy']:>10.0%}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = app.select_pdf_text_backend()
+    print(f"\nAuto-selected backend: {selected}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+gunicorn configuration
+Use with: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 120
+
+# Import the app once in the master so compiled rules, the selected PDF
+# backend and openpyxl are shared copy-on-write by every worker
+preload_app = True
+
+
+def on_starting(server):
+    import app
+    app.warm_up()
@@ -0,0 +1,138 @@
+"""
+Measure how much merchant normalization reduces unique descriptions
+Usage: python merchant_key_report.py [statements/ | report.csv | report.json] [--count 5000]
+With no input a synthetic corpus is used. Its branch names, terminal IDs and
+formats are kept separate from the lists merchant_key() strips, so unknown
+locations show up as extra keys instead of inflating the reduction.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+import app
+
+# (merchant, description formats); {branch}, {store} and {terminal} vary per transaction
+REPORT_MERCHANTS = [
+    ('spinneys', ['SPINNEYS {branch} {store}', 'SPINNEYS-{branch}', 'POS {terminal} SPINNEYS {branch}']),
+    ('waitrose', ['WAITROSE {branch}', 'WAITROSE {store} {branch} ARE']),
+    ('talabat', ['TALABAT.COM', 'TALABAT UAE {terminal}', 'CKO*TALABAT']),
+    ('uber eats', ['UBER *EATS', 'UBER* EATS PENDING', 'UBER *EATS HELP.UBER.COM']),
+    ('uber trip', ['UBER *TRIP', 'UBER *TRIP HELP.UBER.COM']),
+    ('7 eleven', ['7-ELEVEN {store}', '7 ELEVEN {branch}']),
+    ('adnoc', ['ADNOC {store} {branch}', 'ADNOC STATION {store}']),
+    ('salik', ['SALIK RECHARGE {terminal}', 'SALIK TOP UP']),
+    ('spotify', ['PAYPAL *SPOTIFY {terminal}', 'SPOTIFY P{store}']),
+    ('costa coffee', ['COSTA COFFEE {branch}', 'COSTA COFFEE #{store}']),
+    ('ikea', ['IKEA {branch} L.L.C', 'IKEA {branch}']),
+    ('dubai duty free', ['DUBAI DUTY FREE T{store}', 'DUBAI DUTY FREE {terminal}']),
+]
+REPORT_BRANCHES = [
+    'YAS MALL', 'AL WAHDA', 'NAKHEEL MALL', 'THE GREENS', 'ARABIAN RANCHES', 'AL KHAWANEEJ',
+    'DAMAC HILLS', 'AL RIGGA', 'SATWA', 'MEYDAN', 'SAADIYAT', 'AL REEM', 'MUSHRIF', 'UMM SUQEIM',
+]
+
+
+def report_corpus(count, seed=42):
+    """Synthetic (merchant, description) pairs with locations merchant_key() doesn't know"""
+    rng = random.Random(seed)
+    branches = [b for b in REPORT_BRANCHES if b not in app.LOCATION_TOKENS]
+    corpus = []
+    for _ in range(count):
+        merchant, formats = rng.choice(REPORT_MERCHANTS)
+        description = rng.choice(formats).format(
+            branch=rng.choice(branches),
+            store=f"{rng.randint(1, 9999):04d}",
+            terminal=f"{rng.choice(['T', 'TID', ''])}{rng.randint(100000, 9999999)}",
+        )
+        if rng.random() < 0.2:
+            description += f" CARD XXXX{rng.randint(1000, 9999)}"
+        corpus.append((merchant, description))
+    return corpus
+
+
+def load_descriptions(source):
+    if os.path.isdir(source):
+        descriptions = []
+        for root, _dirs, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith('.pdf'):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        expenses = app.extract_expenses_from_pdf(os.path.join(root, name))
+                    descriptions.extend(e['description'] for e in expenses)
+        return descriptions
+    if source.lower().endswith('.json'):
+        with open(source, encoding='utf-8') as f:
+            return [t['description'] for t in json.load(f)['transactions']]
+    # CSV written by batch_process.py
+    with open(source, newline='', encoding='utf-8') as f:
+        return [row['Description'] for row in csv.DictReader(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report unique descriptions before and after merchant normalization')
+    parser.add_argument('source', nargs='?', help='PDF directory, or a CSV/JSON report from batch_process.py')
+    parser.add_argument('--count', type=int, default=5000, help='Synthetic transactions when no source is given')
+    parser.add_argument('--top', type=int, default=10, help='Merchants with the most variants to list')
+    args = parser.parse_args()
+
+    merchants = None
+    if args.source:
+        descriptions = load_descriptions(args.source)
+    else:
+        merchants, descriptions = zip(*report_corpus(args.count)) if args.count > 0 else ((), ())
+    if not descriptions:
+        print("No transactions found")
+        return
+
+    app.merchant_key.cache_clear()
+    started = time.perf_counter()
+    keys = [app.merchant_key(d) for d in descriptions]
+    elapsed = time.perf_counter() - started
+
+    unique_raw = len(set(descriptions))
+    unique_clean = len({app.clean_description(d).lower() for d in descriptions})
+    unique_keys = len(set(keys))
+    variants = defaultdict(set)
+    for description, key in zip(descriptions, keys):
+        variants[key].add(description)
+
+    print(f"Transactions:                   {len(descriptions)}")
+    print(f"Unique raw descriptions:        {unique_raw}")
+    print(f"Unique after clean_description: {unique_clean}")
+    print(f"Unique merchant keys:           {unique_keys}  "
+          f"({1 - unique_keys / unique_raw:.1%} fewer than raw, {1 - unique_keys / unique_clean:.1%} fewer than cleaned)")
+    print(f"Cache/dedupe hit rate:          {1 - unique_keys / len(descriptions):.1%} of transactions reuse a known merchant "
+          f"(was {1 - unique_clean / len(descriptions):.1%})")
+    print(f"Normalization speed:            {len(descriptions) / elapsed if elapsed else 0:,.0f} descriptions/s (cold cache)")
+
+    if merchants:
+        # Only the synthetic corpus knows which merchant each row really is
+        keys_by_merchant = defaultdict(set)
+        merchants_by_key = defaultdict(set)
+        for merchant, key in zip(merchants, keys):
+            keys_by_merchant[merchant].add(key)
+            merchants_by_key[key].add(merchant)
+        print(f"Merchants:                      {len(keys_by_merchant)}")
+        split = {m: k for m, k in keys_by_merchant.items() if len(k) > 1}
+        merged = {k: m for k, m in merchants_by_key.items() if len(m) > 1}
+        print(f"Merchants split over keys:      {len(split)}")
+        for merchant, merchant_keys in sorted(split.items()):
+            print(f"  {merchant:<28} {len(merchant_keys):>5} keys  e.g. {', '.join(sorted(merchant_keys)[:3])}")
+        print(f"Keys shared by merchants:       {len(merged)}")
+        for key, key_merchants in sorted(merged.items()):
+            print(f"  {key:<28} {', '.join(sorted(key_merchants))}")
+
+    print("\nMerchants with the most variants:")
+    for key, examples in sorted(variants.items(), key=lambda item: len(item[1]), reverse=True)[:args.top]:
+        sample = sorted(examples)[0]
+        print(f"  {key:<28} {len(examples):>5} variants  e.g. {sample}")
+
+
+if __name__ == '__main__':
+    main()